@@ -3,46 +3,205 @@
 import time
 import datetime
 import os
-import re
 import sys
+import queue
+import select
+import threading
 import tty
 import termios
 import contextlib
+import io
 
 # Set sensible defaults for the LED brightness and amount to 
 # increment the motor by
 LED_BRIGHTNESS = 0.33
 MOTOR_INCREMENT = 500
 
+# Format for the timelapse folder name and image file names
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H:%M:%S"
+
+# Number of buffers for the camera preview stream; fewer buffers means fewer
+# frames queued between the sensor and the screen
+PREVIEW_BUFFER_COUNT = 2
+
+# Window (in seconds) over which rapid key presses are combined into a
+# single motor move, so that key mashing doesn't queue up serial commands
+MOVE_COALESCE_WINDOW = 0.03
+
+# Time (in seconds) to let the camera's auto exposure settle after the LED is
+# turned on, matching the delay picamzero's take_photo() runs the camera for
+EXPOSURE_SETTLE_TIME = 1
+
+# Capture intervals (in seconds) above which the LED is switched off
+# between frames; faster timelapses leave it on to save serial commands
+LED_TOGGLE_THRESHOLD = 10
+
+# JPEG quality for saved images, matching Picamera2's default
+JPEG_QUALITY = 90
+
+# Number of captured frames allowed to wait for the background writer
+# before the capture loop blocks, bounding memory use on slow SD cards
+WRITE_QUEUE_SIZE = 4
+
+# Map interactive control keys to a relative [x, y, z] move and the
+# message printed for it
+_MOVES = {
+    'w': ((0, MOTOR_INCREMENT, 0), f"Moved Y axis up by {MOTOR_INCREMENT}\n"),
+    's': ((0, -MOTOR_INCREMENT, 0), f"Moved Y axis down by {MOTOR_INCREMENT}\n"),
+    'a': ((-MOTOR_INCREMENT, 0, 0), f"Moved X axis left by {MOTOR_INCREMENT}\n"),
+    'd': ((MOTOR_INCREMENT, 0, 0), f"Moved X axis right by {MOTOR_INCREMENT}\n"),
+    'z': ((0, 0, MOTOR_INCREMENT), f"Moved Z axis up by {MOTOR_INCREMENT}\n"),
+    'x': ((0, 0, -MOTOR_INCREMENT), f"Moved Z axis down by {MOTOR_INCREMENT}\n"),
+}
+
 # Set the environment variable so Qt has a valid runtime directory
 if 'XDG_RUNTIME_DIR' not in os.environ:
     os.environ['XDG_RUNTIME_DIR'] = '/tmp'
 
+# Seconds per unit, in the order units must appear in a time string
+_TIME_UNITS = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+_TIME_UNIT_ORDER = 'dhms'
+
 def parse_time_value(time_str):
     """
     Parse a time string with units such as '5s', '1m', '2h' or compound strings like '1d 4h 30m'
     and return the total seconds.
     """
-    pattern = r"^\s*((?P<days>\d+)\s*d)?\s*((?P<hours>\d+)\s*h)?\s*((?P<minutes>\d+)\s*m)?\s*((?P<seconds>\d+)\s*s)?\s*$"
-    match = re.match(pattern, time_str.strip(), re.IGNORECASE)
-    if not match:
-        return None
-    days = int(match.group('days')) if match.group('days') else 0
-    hours = int(match.group('hours')) if match.group('hours') else 0
-    minutes = int(match.group('minutes')) if match.group('minutes') else 0
-    seconds = int(match.group('seconds')) if match.group('seconds') else 0
-    return days * 86400 + hours * 3600 + minutes * 60 + seconds
-
-def getch():
-    """Capture a single key press without waiting for Enter."""
+    s = time_str.strip().lower()
+    # Fast path for the common single-unit case, e.g. '5s' or '30m'
+    if s and s[-1] in _TIME_UNITS and s[:-1].isdecimal():
+        return int(s[:-1]) * _TIME_UNITS[s[-1]]
+    n = len(s)
+    i = 0
+    total = 0
+    # Units must appear at most once each, in d, h, m, s order
+    next_unit = 0
+    while i < n:
+        start = i
+        while i < n and s[i].isdecimal():
+            i += 1
+        if i == start:
+            return None
+        value = int(s[start:i])
+        while i < n and s[i].isspace():
+            i += 1
+        if i == n:
+            return None
+        unit_index = _TIME_UNIT_ORDER.find(s[i], next_unit)
+        if unit_index < 0:
+            return None
+        total += value * _TIME_UNITS[s[i]]
+        next_unit = unit_index + 1
+        i += 1
+        while i < n and s[i].isspace():
+            i += 1
+    return total
+
+@contextlib.contextmanager
+def cbreak_terminal():
+    """
+    Put the terminal in cbreak mode, so that key presses can be read as they
+    happen without waiting for Enter, and restore it afterwards.
+    """
     fd = sys.stdin.fileno()
     old_settings = termios.tcgetattr(fd)
     try:
-        tty.setraw(fd)
-        ch = sys.stdin.read(1)
+        tty.setcbreak(fd)
+        yield fd
     finally:
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-    return ch
+
+def read_keys(fd, timeout=None):
+    """
+    Return the key presses waiting on fd, or an empty string if none arrive
+    within `timeout` seconds (or block until one does if timeout is None).
+    """
+    if not select.select([fd], [], [], timeout)[0]:
+        return ''
+    return os.read(fd, 64).decode(errors='replace')
+
+@contextlib.contextmanager
+def low_latency_serial(sb):
+    """
+    If the Sangaboard is connected through a USB-serial adapter, set the
+    adapter's latency timer to 1 ms, so that motor and LED commands aren't
+    held back by the default 16 ms timer, and restore it afterwards. Boards
+    on the Raspberry Pi's serial interface have no latency timer to set.
+    """
+    # pysangaboard keeps the pyserial connection it opened in sb._ser
+    port = getattr(getattr(sb, '_ser', None), 'port', None)
+    path = None
+    if port:
+        tty_name = os.path.basename(os.path.realpath(port))
+        path = f'/sys/bus/usb-serial/devices/{tty_name}/latency_timer'
+    old_timer = None
+    if path is not None and os.path.exists(path):
+        try:
+            with open(path) as f:
+                old_timer = f.read().strip()
+            with open(path, 'w') as f:
+                f.write('1')
+            print(f"Set serial latency timer for {tty_name} to 1 ms.")
+        except OSError as e:
+            old_timer = None
+            print(f"Could not set serial latency timer for {tty_name}: {e}")
+    try:
+        yield
+    finally:
+        if old_timer is not None:
+            with contextlib.suppress(OSError):
+                with open(path, 'w') as f:
+                    f.write(old_timer)
+
+def reduce_preview_latency(cam):
+    """
+    Shrink the preview stream's buffer queue, to cut the preview's lag behind
+    the motors. picamzero's Camera() has already started its Picamera2
+    instance (cam.pc2) with the preview configuration, so the camera has to be
+    stopped to reconfigure it. Must be called before the preview is started.
+    """
+    cam.pc2.stop()
+    cam.pc2.preview_configuration.buffer_count = PREVIEW_BUFFER_COUNT
+    cam.pc2.configure("preview")
+    cam.pc2.start()
+
+def save_jpeg(filename, array):
+    """Encode an RGB image array as a JPEG and write it to filename."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, "JPEG", quality=JPEG_QUALITY)
+    # Write the encoded bytes straight to the file descriptor, skipping
+    # the buffered file object
+    data = buffer.getbuffer()
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+def image_writer(frames, errors):
+    """
+    Save captured frames as JPEGs until a None sentinel is received.
+    Runs on a background thread so that encoding and writing to the SD card
+    overlap with the wait for the next frame. If a frame can't be saved, the
+    exception is added to `errors` for the capture loop to report, and later
+    frames are discarded so that the queue never fills up.
+    """
+    while True:
+        item = frames.get()
+        if item is None:
+            break
+        if errors:
+            continue
+        filename, array = item
+        try:
+            save_jpeg(filename, array)
+        except Exception as e:
+            errors.append(e)
+            continue
+        print(f"Saved image: {filename}")
 
 def main():
     from sangaboard import Sangaboard
@@ -51,13 +210,15 @@ def main():
         with contextlib.redirect_stderr(devnull):
             from picamzero import Camera
 
-    # Use Sangaboard as a context manager for proper setup and cleanup
-    with Sangaboard() as sb:
+    # Use Sangaboard as a context manager for proper setup and cleanup, and
+    # reduce the round trip time of each serial command while connected
+    with Sangaboard() as sb, low_latency_serial(sb):
         # Turn LED on
         sb.illumination.cc_led = LED_BRIGHTNESS
         
         # Set up the camera and start preview
         cam = Camera()
+        reduce_preview_latency(cam)
         cam.start_preview()
         print("Camera preview started.\n")
         print("Interactive motor control:")
@@ -66,33 +227,44 @@ def main():
         print("  Z/X: Move Z axis up/down")
         print("\nPress 'c' when ready to proceed to timelapse capture.")
 
-        # Interactive control loop for motor movement using getch()
-        while True:
-            key = getch().lower()
-            if key == 'w':
-                sb.move_rel([0, MOTOR_INCREMENT, 0])
-                print(f"Moved Y axis up by {MOTOR_INCREMENT}")
-            elif key == 's':
-                sb.move_rel([0, -MOTOR_INCREMENT, 0])
-                print(f"Moved Y axis down by {MOTOR_INCREMENT}")
-            elif key == 'a':
-                sb.move_rel([-MOTOR_INCREMENT, 0, 0])
-                print(f"Moved X axis left by {MOTOR_INCREMENT}")
-            elif key == 'd':
-                sb.move_rel([MOTOR_INCREMENT, 0, 0])
-                print(f"Moved X axis right by {MOTOR_INCREMENT}")
-            elif key == 'z':
-                sb.move_rel([0, 0, MOTOR_INCREMENT])
-                print(f"Moved Z axis up by {MOTOR_INCREMENT}")
-            elif key == 'x':
-                sb.move_rel([0, 0, -MOTOR_INCREMENT])
-                print(f"Moved Z axis down by {MOTOR_INCREMENT}")
-            elif key == 'c':
-                print("Exiting interactive mode. Proceeding to timelapse setup.")
-                break
-            else:
-                # Optionally, ignore unknown keys or print a message.
-                print(f"Unknown command: {key}")
+        # Interactive control loop for motor movement. Moves are collected
+        # for MOVE_COALESCE_WINDOW after the first key press and then sent as
+        # one command, with select() waking the loop to flush them on time.
+        with cbreak_terminal() as fd:
+            # Reused for every move rather than allocating a new list
+            pending = [0, 0, 0]
+            flush_at = None
+            proceed = False
+            write = sys.stdout.write
+            while not proceed:
+                # Show this iteration's messages before waiting for more keys
+                sys.stdout.flush()
+                if flush_at is None:
+                    timeout = None
+                else:
+                    timeout = max(0, flush_at - time.monotonic())
+                for key in read_keys(fd, timeout).lower():
+                    if key == 'c':
+                        proceed = True
+                        break
+                    move = _MOVES.get(key)
+                    if move is None:
+                        # Optionally, ignore unknown keys or print a message.
+                        write(f"Unknown command: {key}\n")
+                        continue
+                    (dx, dy, dz), message = move
+                    pending[0] += dx
+                    pending[1] += dy
+                    pending[2] += dz
+                    if flush_at is None:
+                        flush_at = time.monotonic() + MOVE_COALESCE_WINDOW
+                    write(message)
+                if flush_at is not None and (proceed or time.monotonic() >= flush_at):
+                    if any(pending):
+                        sb.move_rel(pending)
+                    pending[0] = pending[1] = pending[2] = 0
+                    flush_at = None
+        print("Exiting interactive mode. Proceeding to timelapse setup.")
 
         # Stop the camera preview before timelapse capture starts
         cam.stop_preview()
@@ -116,24 +288,90 @@ def main():
 
         # Create a folder for the timelapse images
         start_time = datetime.datetime.now()
-        folder_name = start_time.strftime("%Y-%m-%d_%H:%M:%S")
+        folder_name = start_time.strftime(TIMESTAMP_FORMAT)
         os.makedirs(folder_name, exist_ok=True)
         print(f"Images will be saved to folder: {folder_name}")
 
-        # Start the timelapse capture loop
-        end_time = start_time + datetime.timedelta(seconds=total_duration)
+        # Image file names all share the folder prefix, so build it once
+        prefix = folder_name + os.sep
+
+        frame = 0
+        last_timestamp = None
+        repeat = 0
+        # Hand frames to a background thread to be encoded and saved
+        frames = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        write_errors = []
+        writer = threading.Thread(target=image_writer, args=(frames, write_errors))
+        writer.start()
+        # Only switch the LED off between frames for slow timelapses,
+        # otherwise leave it on for the whole capture
+        toggle_led = frequency > LED_TOGGLE_THRESHOLD
+        illum = sb.illumination
         print("Starting timelapse capture...")
-        while datetime.datetime.now() < end_time:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-            filename = os.path.join(folder_name, f"{timestamp}.jpg")
-            # Turn LED on
-            sb.illumination.cc_led = LED_BRIGHTNESS
-            # Take a photo and save it to the filename
-            cam.take_photo(filename)
-            # Turn LED off immediately after capture
-            sb.illumination.cc_led = 0.0
-            print(f"Captured image: {filename}")
-            time.sleep(frequency)
+        try:
+            if not toggle_led:
+                # Turn LED on for the whole timelapse, and let the exposure
+                # settle before the first frame
+                illum.cc_led = LED_BRIGHTNESS
+                time.sleep(EXPOSURE_SETTLE_TIME)
+            # Start the timelapse capture loop, timed against the monotonic
+            # clock so that wall-clock adjustments don't shorten or stretch it
+            t0 = time.monotonic()
+            deadline = t0 + total_duration
+            while time.monotonic() < deadline:
+                # Stop if the writer has failed to save a frame
+                if write_errors:
+                    break
+                timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+                # Number any further frames within the same second, so they
+                # don't overwrite each other
+                if timestamp == last_timestamp:
+                    repeat += 1
+                    filename = f"{prefix}{timestamp}_{repeat}.jpg"
+                else:
+                    repeat = 0
+                    filename = f"{prefix}{timestamp}.jpg"
+                last_timestamp = timestamp
+                if toggle_led:
+                    # Turn LED on, and let the exposure adjust from the dark
+                    # before capturing
+                    illum.cc_led = LED_BRIGHTNESS
+                    time.sleep(EXPOSURE_SETTLE_TIME)
+                # Take a photo into memory
+                array = cam.capture_array()
+                if toggle_led:
+                    # Turn LED off immediately after capture
+                    illum.cc_led = 0.0
+                # Queue the photo to be saved to the filename
+                frames.put((filename, array))
+                print(f"Captured image: {filename}")
+                # Sleep until the next frame's absolute start time, so capture
+                # latency doesn't accumulate as drift across the timelapse.
+                # Ticks missed by a slow capture are skipped, not caught up on.
+                frame = max(frame + 1, int((time.monotonic() - t0) // frequency) + 1)
+                delay = t0 + frame * frequency - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            try:
+                # Turn LED off
+                illum.cc_led = 0.0
+            finally:
+                # Let the writer finish saving any queued frames, even if the
+                # Sangaboard has stopped responding, without blocking on a
+                # full queue if the writer is no longer running
+                while writer.is_alive():
+                    try:
+                        frames.put(None, timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+                writer.join()
+
+        if write_errors:
+            print(f"Could not save image: {write_errors[0]}")
+            print("Timelapse stopped.")
+            return
 
         print("Timelapse complete.")
 